@@ -1,17 +1,21 @@
 # app.py
-import re
 import io
 import datetime
 import base64
-from typing import List, Dict, Any
+import hashlib
+from typing import Callable, List, Dict, Any, Optional, Tuple
 
 import streamlit as st
 import pandas as pd
-import pdfplumber
+import xlsxwriter
 from supabase import create_client
+from postgrest.types import ReturnMethod
 from dotenv import load_dotenv
 import os
-import xml.etree.ElementTree as ET
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from extractor import RESULT_FIELDS, pdf_pool, pdf_worker_count, process_pdf
 
 load_dotenv()
 
@@ -25,6 +29,25 @@ if SUPABASE_URL and SUPABASE_KEY:
 else:
     supabase = None
 
+@st.cache_resource
+def log_executor() -> ThreadPoolExecutor:
+    """One background thread shared by all sessions, so Supabase round-trips never block a rerun."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="supabase-log")
+
+def insert_logs(log_payloads: List[Dict[str, Any]], return_ids: bool = False) -> List[Any]:
+    """
+    Insert extraction_logs rows with a single request. Unless return_ids, the rows are not sent
+    back (returning=minimal), so the server skips reading them out again.
+    """
+    returning = ReturnMethod.representation if return_ids else ReturnMethod.minimal
+    resp = supabase.table("extraction_logs").insert(log_payloads, returning=returning).execute()
+    return [row.get("id") for row in resp.data or []] if return_ids else []
+
+def insert_log(log_payload: Dict[str, Any]) -> Optional[Any]:
+    """Insert one extraction_logs row and return its id (None if the response has no row)."""
+    ids = insert_logs([log_payload], return_ids=True)
+    return ids[0] if ids else None
+
 # -----------------------
 # Palette / Theme colors
 # -----------------------
@@ -51,96 +74,164 @@ st.markdown(
     """, unsafe_allow_html=True)
 
 # -----------------------
-# Helper extraction functions
+# Cached extraction
 # -----------------------
-MONTHS_ID = {
-    "Januari": "01", "Februari": "02", "Maret": "03", "April": "04",
-    "Mei": "05", "Juni": "06", "Juli": "07", "Agustus": "08",
-    "September": "09", "Oktober": "10", "November": "11", "Desember": "12"
-}
+@st.cache_resource
+def pdf_workers() -> Optional[ProcessPoolExecutor]:
+    """One PDF worker pool shared by all sessions, forked once rather than on every Extract click."""
+    return pdf_pool()
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def extract_pdf(digest: bytes, _file_bytes: bytes, _pool: Optional[Executor] = None) -> Dict[str, str]:
+    """process_pdf memoised on the file's content digest, so extracting an already-seen PDF again is free.
+    Runs in _pool when given. Underscored arguments stay out of the cache key, so Streamlit hashes the
+    16-byte digest instead of copying and md5-ing the whole PDF on every call."""
+    if _pool is None:
+        return process_pdf(_file_bytes)
+    return _pool.submit(process_pdf, _file_bytes).result()
+
+def extract_pdfs(payloads: List[bytes],
+                 on_progress: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, str]]:
+    """extract_pdf for every payload, in order. on_progress(done, total) is called on the calling
+    thread as each distinct file finishes, so it may update Streamlit elements."""
+    digests = [hashlib.blake2b(b, digest_size=16).digest() for b in payloads]
+    # The same PDF attached twice is parsed once; concurrent cache lookups would both miss on it
+    unique = dict(zip(digests, payloads))
+    parsed: Dict[bytes, Dict[str, str]] = {}
+    pool = pdf_workers() if len(unique) > 1 else None
+    if pool is None:
+        for d, b in unique.items():
+            parsed[d] = extract_pdf(d, b)
+            if on_progress:
+                on_progress(len(parsed), len(unique))
+    else:
+        # Cache misses block on the worker pool, so look them up from threads to keep every worker busy
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(unique), pdf_worker_count())) as ex:
+                futures = {ex.submit(extract_pdf, d, b, pool): d for d, b in unique.items()}
+                for future in as_completed(futures):
+                    parsed[futures[future]] = future.result()
+                    if on_progress:
+                        on_progress(len(parsed), len(unique))
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool on the next click
+            pdf_workers.clear()
+            raise
+    return [parsed[d] for d in digests]
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def serialize_results(df: pd.DataFrame) -> Tuple[bytes, bytes, str]:
+    """CSV bytes, XLSX bytes and the tab-separated clipboard text for a results table.
+    Cached so widget reruns reuse them instead of re-serializing the whole table."""
+    csv_buffer = io.BytesIO()
+    df.to_csv(csv_buffer, index=False, encoding="utf-8")
+    xlsx_buffer = io.BytesIO()
+    # constant_memory streams each finished row to a temp file instead of keeping every cell in RAM.
+    # It only accepts rows in order, and pandas' to_excel writes column by column (cells outside the
+    # current row get dropped), so the rows are written directly.
+    workbook = xlsxwriter.Workbook(xlsx_buffer, {"constant_memory": True})
+    sheet = workbook.add_worksheet("extraction")
+    header = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    sheet.write_row(0, 0, df.columns, header)
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        sheet.write_row(i, 0, row)
+    workbook.close()
+    return csv_buffer.getvalue(), xlsx_buffer.getvalue(), df.to_csv(sep="\t", index=False)
 
-def parse_date_from_text(text: str) -> str:
+# -----------------------
+# Faktur XML
+# -----------------------
+# (XML tag, Excel column or None for a constant, value used when the column is absent)
+FAKTUR_FIELDS = (
+    ("TaxInvoiceDate", "Tanggal Faktur", ""),
+    ("TaxInvoiceOpt", "Jenis Faktur", "Normal"),
+    ("TrxCode", "Kode Transaksi", "04"),
+    ("AddInfo", "Referensi", ""),
+    ("CustomDoc", "Nomor Seri Faktur", ""),
+    ("CustomDocMonthYear", "Periode Pajak", ""),
+    ("RefDesc", None, ""),
+    ("FacilityStamp", "Dokumen", ""),
+    ("SellerIDTKU", "IDTKU Penjual", ""),
+    ("BuyerTin", "NPWP Pembeli", ""),
+    ("BuyerDocument", None, "TIN"),
+    ("BuyerCountry", None, "IDN"),
+    ("BuyerDocumentNumber", None, ""),
+    ("BuyerName", "Nama Pembeli", ""),
+    ("BuyerAdress", "Alamat Pembeli", ""),
+    ("BuyerEmail", "Email Pembeli", ""),
+    ("BuyerIDTKU", "IDTKU Pembeli", ""),
+)
+GOODS_FIELDS = (
+    ("Opt", "Opt", "A"),
+    ("Code", "Kode Barang", "000000"),
+    ("Name", "Nama Barang", "Barang"),
+    ("Unit", "Unit", "UM.0001"),
+    ("Price", "Harga Satuan", "0"),
+    ("Qty", "Jumlah", "1"),
+    ("TotalDiscount", "Diskon", "0"),
+    ("TaxBase", "DPP", "0"),
+    ("OtherTaxBase", "DPP", "0"),
+    ("VATRate", "Tarif PPN", "11"),
+    ("VAT", "PPN", "0"),
+    ("STLGRate", "Tarif PPnBM", "0"),
+    ("STLG", "PPnBM", "0"),
+)
+
+# Only these columns are parsed out of the workbook; everything else in the template is skipped
+FAKTUR_COLUMNS = {"Baris"} | {col for _, col, _ in FAKTUR_FIELDS if col}
+GOODS_COLUMNS = {"Baris"} | {col for _, col, _ in GOODS_FIELDS if col}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def read_faktur_workbook(xlsx_bytes: bytes) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
     """
-    Looks for date formats like:
-    'KOTA ADM. JAKARTA SELATAN, 30 September 2025'
-    or 'Jakarta 30 September 2025'
-    Returns DD/MM/YYYY or empty string.
+    (Faktur rows, DetailFaktur rows, seller TIN from cell B1) from one pass over the workbook.
+    Cells are read as text (dtype=str), so codes like "04" and long NPWPs are kept exactly as typed
+    instead of going through float inference. Cached on the file content for repeat reruns.
     """
-    m = re.search(r"(?:,|\b)\s*(\d{1,2})\s+([A-Za-z]+)\s+(\d{4})", text)
-    if not m:
-        return ""
-    day, mon_name, year = m.group(1), m.group(2), m.group(3)
-    month_num = MONTHS_ID.get(mon_name.capitalize())
-    if not month_num:
-        return ""
-    return f"{int(day):02d}/{month_num}/{year}"
+    with pd.ExcelFile(io.BytesIO(xlsx_bytes), engine="openpyxl") as book:
+        # Read Faktur with header starting from row 3 (index 2)
+        df_faktur = book.parse("Faktur", header=2, dtype=str, usecols=lambda c: c in FAKTUR_COLUMNS)
+        df_detail = book.parse("DetailFaktur", header=0, dtype=str, usecols=lambda c: c in GOODS_COLUMNS)
+        # Extract NPWP Penjual (TIN) from cell B1
+        try:
+            df_tmp = book.parse("Faktur", header=None, nrows=1, dtype=str)
+            tin_value = str(df_tmp.iloc[0, 1]).strip() if pd.notna(df_tmp.iloc[0, 1]) else ""
+        except Exception:
+            tin_value = ""
+    return df_faktur, df_detail, tin_value
 
-def parse_kode_seri_type(text: str) -> Dict[str, str]:
-    """
-    Find 'Kode dan Nomor Seri Faktur Pajak: 0400250031...' -> get first 3 digits
-    If starts with 040 => Normal else Pembetulan
-    """
-    m = re.search(r"Kode dan Nomor Seri Faktur Pajak\s*:\s*([0-9A-Za-z\-]+)", text)
-    if m:
-        code = m.group(1).strip()
-        prefix = code[:3]
-        ftype = "Normal" if prefix == "040" else "Pembetulan"
-        return {"raw_code": code, "type": ftype}
-    return {"raw_code": "", "type": ""}
-
-def parse_reference(text: str) -> str:
-    """
-    Captures full reference text after 'Referensi:' until newline and trims trailing ).
-    """
-    m = re.search(r"Referensi\s*:\s*(.+)", text)
-    if not m:
+def xml_escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def xml_text(val: Any) -> str:
+    """Cell value as escaped element text: blank for NaN/None, otherwise stripped str()."""
+    if pd.isna(val):
         return ""
-    ref_line = m.group(1).strip()
-    ref_line = ref_line.splitlines()[0].strip()
-    ref_line = ref_line.rstrip(")")
-    return ref_line
-
-def extract_buyer_block(text: str) -> str:
-    """Return the text block for 'Pembeli Barang Kena Pajak / Penerima Jasa Kena Pajak' section."""
-    m = re.search(
-        r"Pembeli Barang Kena Pajak\/Penerima Jasa Kena Pajak(.*?)(?:Nama Barang Kena Pajak|Dasar Pengenaan Pajak)",
-        text, re.S)
-    return m.group(1) if m else ""
-
-def parse_buyer_fields(text: str) -> Dict[str, str]:
-    b = extract_buyer_block(text)
-    result = {"buyer_npwp": "", "buyer_name": "", "buyer_address": "", "buyer_email": "", "buyer_id_tku": ""}
-
-    m = re.search(r"NPWP\s*:\s*([0-9\.]+)", b)
-    if m:
-        result["buyer_npwp"] = re.sub(r"\D", "", m.group(1))
-
-    m = re.search(r"Nama\s*:\s*(.+)", b)
-    if m:
-        result["buyer_name"] = m.group(1).strip()
-
-    m = re.search(r"Alamat\s*:\s*(.*?)\s*(?:NPWP|Email|$)", b, re.S)
-    if m:
-        address = " ".join(line.strip() for line in m.group(1).splitlines() if line.strip())
-        result["buyer_address"] = address.strip()
-
-    m = re.search(r"Email\s*:\s*([\w\.-]+@[\w\.-]+)", b)
-    if m:
-        result["buyer_email"] = m.group(1).strip()
-
-    m = re.search(r"#\s*(\d{8,30})", b)
-    if m:
-        result["buyer_id_tku"] = m.group(1).strip()
-
-    return result
-
-def extract_text_from_pdf_bytes(file_bytes: bytes) -> str:
-    text = ""
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
-    return text
+    return xml_escape(str(val).strip())
+
+def baris_key(val: Any) -> str:
+    """Baris cell as a lookup key: stripped text without a trailing ".0", so 1 and 1.0 match."""
+    text = str(val).strip()
+    return text[:-2] if text.endswith(".0") else text
+
+# One str.format template per row shape: every invoice and every goods line has the same tags
+FAKTUR_TEMPLATE = ("<TaxInvoice>" + "".join(f"<{tag}>{{}}</{tag}>" for tag, _, _ in FAKTUR_FIELDS)
+                   + "<ListOfGoodService>{}</ListOfGoodService></TaxInvoice>")
+GOODS_TEMPLATE = "<GoodService>" + "".join(f"<{tag}>{{}}</{tag}>" for tag, _, _ in GOODS_FIELDS) + "</GoodService>"
+
+def xml_values(df: pd.DataFrame, fields) -> List[Tuple[str, ...]]:
+    """Escaped element texts per row of df, in field order, built column by column."""
+    columns = []
+    cleaned: Dict[str, List[str]] = {}  # a column feeding several tags (DPP) is cleaned only once
+    for tag, col, default in fields:
+        if col is not None and col in df.columns:
+            if col not in cleaned:
+                # Cells are read as text, so str is the fast path; only blanks (NaN) go through xml_text
+                cleaned[col] = [xml_escape(v.strip()) if isinstance(v, str) else xml_text(v) for v in df[col]]
+            columns.append(cleaned[col])
+        else:
+            columns.append([xml_text(default)] * len(df))
+    return list(zip(*columns))
 
 # -----------------------
 # UI
@@ -173,79 +264,42 @@ else:
 
     xlsx_file = st.file_uploader("Upload Faktur Excel", type=["xlsx"], key="xml_converter_uploader")
 
-    if xlsx_file is not None:
-        # Read Faktur with header starting from row 3 (index 2)
-        df_faktur = pd.read_excel(xlsx_file, sheet_name="Faktur", header=2)
-        df_detail = pd.read_excel(xlsx_file, sheet_name="DetailFaktur", header=0)
+    # The last conversion's log insert runs in the background; report a failure once it has finished
+    xml_log_future = st.session_state.get("xml_log_future")
+    if xml_log_future is not None and xml_log_future.done():
+        del st.session_state["xml_log_future"]
+        if xml_log_future.exception() is not None:
+            st.warning(f"Supabase logging failed: {xml_log_future.exception()}")
 
-        # Extract NPWP Penjual (TIN) from cell B1
-        tin_value = ""
-        try:
-            df_tmp = pd.read_excel(xlsx_file, sheet_name="Faktur", header=None)
-            tin_value = str(df_tmp.iloc[0, 1]).strip() if pd.notna(df_tmp.iloc[0, 1]) else ""
-        except Exception:
-            tin_value = ""
+    if xlsx_file is not None:
+        df_faktur, df_detail, tin_value = read_faktur_workbook(xlsx_file.getvalue())
 
         st.write(f"📄 Loaded {len(df_faktur)} Faktur rows and {len(df_detail)} DetailFaktur rows")
 
         if st.button("Convert to XML"):
             with st.spinner("Converting XLSX to XML..."):
-                # Build XML root with namespace
-                root = ET.Element(
-                    "TaxInvoiceBulk",
-                    attrib={
-                        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-                        "xsi:noNamespaceSchemaLocation": "TaxInvoice.xsd",
-                    },
-                )
-                ET.SubElement(root, "TIN").text = tin_value or "999999999999999"
-                list_invoices = ET.SubElement(root, "ListOfTaxInvoice")
-
-                def set_elem(parent, tag, val):
-                    ET.SubElement(parent, tag).text = "" if pd.isna(val) else str(val).strip()
-
-                for _, row in df_faktur.iterrows():
-                    faktur_elem = ET.SubElement(list_invoices, "TaxInvoice")
-                    set_elem(faktur_elem, "TaxInvoiceDate", row.get("Tanggal Faktur", ""))
-                    set_elem(faktur_elem, "TaxInvoiceOpt", row.get("Jenis Faktur", "Normal"))
-                    set_elem(faktur_elem, "TrxCode", row.get("Kode Transaksi", "04"))
-                    set_elem(faktur_elem, "AddInfo", row.get("Referensi", ""))
-                    set_elem(faktur_elem, "CustomDoc", row.get("Nomor Seri Faktur", ""))
-                    set_elem(faktur_elem, "CustomDocMonthYear", row.get("Periode Pajak", ""))
-                    set_elem(faktur_elem, "RefDesc", "")
-                    set_elem(faktur_elem, "FacilityStamp", row.get("Dokumen", ""))
-                    set_elem(faktur_elem, "SellerIDTKU", row.get("IDTKU Penjual", ""))
-                    set_elem(faktur_elem, "BuyerTin", row.get("NPWP Pembeli", ""))
-                    set_elem(faktur_elem, "BuyerDocument", "TIN")
-                    set_elem(faktur_elem, "BuyerCountry", "IDN")
-                    set_elem(faktur_elem, "BuyerDocumentNumber", "")
-                    set_elem(faktur_elem, "BuyerName", row.get("Nama Pembeli", ""))
-                    set_elem(faktur_elem, "BuyerAdress", row.get("Alamat Pembeli", ""))
-                    set_elem(faktur_elem, "BuyerEmail", row.get("Email Pembeli", ""))
-                    set_elem(faktur_elem, "BuyerIDTKU", row.get("IDTKU Pembeli", ""))
-
-                    list_goods = ET.SubElement(faktur_elem, "ListOfGoodService")
-                    baris = row.get("Baris")
-                    if pd.notna(baris):
-                        detail_rows = df_detail[df_detail["Baris"] == baris]
-                        for _, d in detail_rows.iterrows():
-                            goods_elem = ET.SubElement(list_goods, "GoodService")
-                            set_elem(goods_elem, "Opt", d.get("Opt", "A"))
-                            set_elem(goods_elem, "Code", d.get("Kode Barang", "000000"))
-                            set_elem(goods_elem, "Name", d.get("Nama Barang", "Barang"))
-                            set_elem(goods_elem, "Unit", d.get("Unit", "UM.0001"))
-                            set_elem(goods_elem, "Price", d.get("Harga Satuan", "0"))
-                            set_elem(goods_elem, "Qty", d.get("Jumlah", "1"))
-                            set_elem(goods_elem, "TotalDiscount", d.get("Diskon", "0"))
-                            set_elem(goods_elem, "TaxBase", d.get("DPP", "0"))
-                            set_elem(goods_elem, "OtherTaxBase", d.get("DPP", "0"))
-                            set_elem(goods_elem, "VATRate", d.get("Tarif PPN", "11"))
-                            set_elem(goods_elem, "VAT", d.get("PPN", "0"))
-                            set_elem(goods_elem, "STLGRate", d.get("Tarif PPnBM", "0"))
-                            set_elem(goods_elem, "STLG", d.get("PPnBM", "0"))
+                # Serialized straight to text: the document is write-only, so no element tree is needed
+                # Index the detail rows by Baris once instead of scanning the whole sheet per invoice
+                goods_by_baris: Dict[str, List[str]] = {}
+                if "Baris" in df_detail.columns:
+                    for baris, values in zip(df_detail["Baris"], xml_values(df_detail, GOODS_FIELDS)):
+                        if pd.notna(baris):
+                            goods_by_baris.setdefault(baris_key(baris), []).append(GOODS_TEMPLATE.format(*values))
+                barises = df_faktur["Baris"] if "Baris" in df_faktur.columns else [None] * len(df_faktur)
+                invoice_xml = []
+                for values, baris in zip(xml_values(df_faktur, FAKTUR_FIELDS), barises):
+                    goods_xml = "".join(goods_by_baris.get(baris_key(baris), ())) if pd.notna(baris) else ""
+                    invoice_xml.append(FAKTUR_TEMPLATE.format(*values, goods_xml))
 
                 # Convert XML to bytes (with proper declaration)
-                xml_bytes = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+                xml_bytes = (
+                    "<?xml version='1.0' encoding='utf-8'?>\n"
+                    '<TaxInvoiceBulk xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                    ' xsi:noNamespaceSchemaLocation="TaxInvoice.xsd">'
+                    f"<TIN>{xml_text(tin_value or '999999999999999')}</TIN>"
+                    f"<ListOfTaxInvoice>{''.join(invoice_xml)}</ListOfTaxInvoice>"
+                    "</TaxInvoiceBulk>"
+                ).encode("utf-8")
                 st.success("✅ Conversion complete!")
 
                 # ---- Supabase log ----
@@ -255,11 +309,8 @@ else:
                         "status": "Converted",
                         "details": {"filename": xlsx_file.name, "type": "XML"},
                     }
-                    try:
-                        supabase.table("extraction_logs").insert(log_payload).execute()
-                        st.caption("Log saved to Supabase.")
-                    except Exception as e:
-                        st.warning(f"Supabase logging failed: {e}")
+                    st.session_state["xml_log_future"] = log_executor().submit(insert_logs, [log_payload])
+                    st.caption("Log queued for Supabase.")
                 else:
                     st.info("Supabase not configured; skipping logging.")
 
@@ -278,8 +329,8 @@ st.checkbox("I confirm these are Coretax-format Faktur Pajak PDFs", value=False,
 # Session storage for results
 if "results_df" not in st.session_state:
     st.session_state["results_df"] = None
-if "last_log_id" not in st.session_state:
-    st.session_state["last_log_id"] = None
+if "log_future" not in st.session_state:
+    st.session_state["log_future"] = None
 
 extract_col, reset_col = st.columns([1,1])
 with extract_col:
@@ -305,30 +356,17 @@ if extract_btn:
     else:
         st.session_state["is_extracting"] = True
         with st.spinner("⏳ Extracting data, please wait..."):
-            rows = []
-            for f in uploaded:
-                raw = f.read()
-                text = extract_text_from_pdf_bytes(raw)
-                date = parse_date_from_text(text)
-                kode_info = parse_kode_seri_type(text)
-                reference = parse_reference(text)
-                buyer = parse_buyer_fields(text)
-
-                row = {
-                    "source_filename": f.name,
-                    "date": date,
-                    "facture_type": kode_info.get("type"),
-                    "kode_seri_raw": kode_info.get("raw_code"),
-                    "reference": reference,
-                    "buyer_npwp": buyer.get("buyer_npwp"),
-                    "buyer_name": buyer.get("buyer_name"),
-                    "buyer_address": buyer.get("buyer_address"),
-                    "buyer_email": buyer.get("buyer_email"),
-                    "buyer_id_tku": buyer.get("buyer_id_tku")
-                }
-                rows.append(row)
-
-            df = pd.DataFrame(rows)
+            # getvalue() returns the upload's own bytes without a copy, whatever the read position
+            payloads = [f.getvalue() for f in uploaded]
+            progress = st.progress(0.0)
+            results = extract_pdfs(payloads, lambda done, total: progress.progress(
+                done / total, text=f"Parsed {done} of {total} PDFs"))
+            progress.empty()
+            # Column-wise: pandas gets one list per column instead of inferring a schema per row dict
+            cols = {"source_filename": [f.name for f in uploaded]}
+            cols.update((k, [r[k] for r in results]) for k in RESULT_FIELDS)
+
+            df = pd.DataFrame(cols)
             st.session_state["results_df"] = df
 
             if supabase:
@@ -337,31 +375,26 @@ if extract_btn:
                     "status": "Processed",
                     "details": {"files": [f.name for f in uploaded]}
                 }
-                try:
-                    resp = supabase.table("extraction_logs").insert(log_payload).execute()
-                    try:
-                        inserted = resp.data[0]
-                        st.session_state["last_log_id"] = inserted.get("id")
-                    except Exception:
-                        st.session_state["last_log_id"] = None
-                except Exception as e:
-                    st.error(f"Supabase logging failed: {e}")
+                # Logged off the script thread; the id is only needed later by "Mark as Downloaded"
+                st.session_state["log_future"] = log_executor().submit(insert_log, log_payload)
             else:
                 st.info("Supabase not configured; skipping logging.")
         st.session_state["is_extracting"] = False
 
 # Show results
+# Larger result sets are previewed in part; the downloads below always carry every row
+PREVIEW_ROWS = 50
 if st.session_state["results_df"] is not None:
     df = st.session_state["results_df"]
     st.markdown("### Extraction results")
-    st.dataframe(df)
+    if len(df) <= PREVIEW_ROWS:
+        st.dataframe(df)
+    else:
+        with st.expander(f"Preview first {PREVIEW_ROWS} of {len(df)} rows"):
+            st.dataframe(df.head(PREVIEW_ROWS))
 
     # Downloads
-    csv = df.to_csv(index=False).encode("utf-8")
-    xlsx_buffer = io.BytesIO()
-    with pd.ExcelWriter(xlsx_buffer, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="extraction")
-    xlsx_data = xlsx_buffer.getvalue()
+    csv, xlsx_data, tsv = serialize_results(df)
 
     col_a, col_b, col_c = st.columns([1,1,1])
     with col_a:
@@ -370,16 +403,23 @@ if st.session_state["results_df"] is not None:
         st.download_button("Download XLSX", data=xlsx_data, file_name="extraction.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
     with col_c:
         # Copy as plain text to clipboard is browser-level; provide a textarea for manual copy
-        st.text_area("Copy results (select all to copy):", value=df.to_csv(sep="\t", index=False), height=120)
+        st.text_area("Copy results (select all to copy):", value=tsv, height=120)
 
     # If user downloads — we try to update Supabase status to Downloaded.
     # Note: Streamlit's download button cannot give a callback event when click completes.
     # We provide a manual "Mark Downloaded" button to update the log.
-    if st.session_state.get("last_log_id"):
+    log_future = st.session_state.get("log_future")
+    if log_future is not None and log_future.done() and log_future.exception() is not None:
+        st.error(f"Supabase logging failed: {log_future.exception()}")
+    elif log_future is not None and (not log_future.done() or log_future.result()):
         if st.button("Mark as Downloaded (update log)"):
             if supabase:
                 try:
-                    supabase.table("extraction_logs").update({"status":"Downloaded"}).eq("id", st.session_state["last_log_id"]).execute()
+                    # Waits for the insert only if it is somehow still in flight
+                    log_id = log_future.result()
+                    if log_id is None:
+                        raise RuntimeError("log insert returned no id")
+                    supabase.table("extraction_logs").update({"status":"Downloaded"}).eq("id", log_id).execute()
                     st.success("Log updated to Downloaded.")
                 except Exception as e:
                     st.error(f"Failed to update log: {e}")
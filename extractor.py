@@ -0,0 +1,261 @@
+# extractor.py
+"""Coretax Faktur Pajak PDF parsing, kept free of Streamlit so worker processes can import it."""
+import io
+import re
+import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import pdfplumber
+import pypdfium2 as pdfium
+
+# -----------------------
+# Helper extraction functions
+# -----------------------
+MONTHS_ID = {
+    "Januari": "01", "Februari": "02", "Maret": "03", "April": "04",
+    "Mei": "05", "Juni": "06", "Juli": "07", "Agustus": "08",
+    "September": "09", "Oktober": "10", "November": "11", "Desember": "12"
+}
+
+# Patterns are compiled once at import; the parsers below run them for every uploaded PDF.
+# Label-prefixed patterns (Kode..., Referensi, NPWP, ...) let the engine jump straight to the label,
+# so the date is the only pattern that walks the whole text. Its old "(?:,|\b)\s*" prefix only
+# required that the day does not follow a word character; the lookbehind says exactly that.
+# Digit and word classes are spelled out in ASCII (Coretax never prints anything else there), which
+# spares the engine a Unicode property lookup per character. \s stays Unicode on purpose: PDF text
+# can separate tokens with non-breaking spaces, which re.ASCII would stop matching.
+_DATE_RE = re.compile(r"(?<![0-9A-Za-z_])([0-9]{1,2})\s+([A-Za-z]+)\s+([0-9]{4})")
+_KODE_RE = re.compile(r"Kode dan Nomor Seri Faktur Pajak\s*:\s*([0-9A-Za-z\-]+)")
+_NPWP_RE = re.compile(r"NPWP\s*:\s*([0-9\.]+)")
+_EMAIL_RE = re.compile(r"Email\s*:\s*([0-9A-Za-z_.-]+@[0-9A-Za-z_.-]+)")
+_TKU_RE = re.compile(r"#\s*([0-9]{8,30})")
+# The NPWP capture is digits and dots only, so dropping the dots leaves just the digits
+_NPWP_STRIP = str.maketrans("", "", ".")
+
+def _value_start(text: str, label: str) -> int:
+    r"""Index just past the first '<label> :' and the whitespace after it (label\s*:\s*), or -1."""
+    n = len(text)
+    i = text.find(label)
+    while i >= 0:
+        j = i + len(label)
+        while j < n and text[j].isspace():
+            j += 1
+        if j < n and text[j] == ":":
+            j += 1
+            while j < n and text[j].isspace():
+                j += 1
+            return j
+        i = text.find(label, i + 1)
+    return -1
+
+def _labelled_line(text: str, label: str) -> Optional[str]:
+    r"""
+    The value after the first '<label> :' in text, up to the end of its line (the value may start
+    on a following line), or None. Same match as re.search(label + r"\s*:\s*(.+)") using only
+    str.find and whitespace skips.
+    """
+    j = _value_start(text, label)
+    if j < 0 or j == len(text):
+        return None
+    end = text.find("\n", j)
+    return text[j:end] if end >= 0 else text[j:]
+
+def parse_date_from_text(text: str, start: int = 0) -> str:
+    """
+    Looks for date formats like:
+    'KOTA ADM. JAKARTA SELATAN, 30 September 2025'
+    or 'Jakarta 30 September 2025'
+    at or after index start. Returns DD/MM/YYYY or empty string.
+    """
+    m = _DATE_RE.search(text, start)
+    if not m:
+        return ""
+    day, mon_name, year = m.group(1), m.group(2), m.group(3)
+    month_num = MONTHS_ID.get(mon_name.capitalize())
+    if not month_num:
+        return ""
+    return f"{int(day):02d}/{month_num}/{year}"
+
+def parse_kode_seri_type(text: str) -> Dict[str, str]:
+    """
+    Find 'Kode dan Nomor Seri Faktur Pajak: 0400250031...' -> get first 3 digits
+    If starts with 040 => Normal else Pembetulan
+    """
+    m = _KODE_RE.search(text)
+    if m:
+        code = m.group(1).strip()
+        prefix = code[:3]
+        ftype = "Normal" if prefix == "040" else "Pembetulan"
+        return {"raw_code": code, "type": ftype}
+    return {"raw_code": "", "type": ""}
+
+def parse_reference(text: str) -> str:
+    """
+    Captures full reference text after 'Referensi:' until newline and trims trailing ).
+    """
+    ref_line = _labelled_line(text, "Referensi")
+    if ref_line is None:
+        return ""
+    ref_line = ref_line.splitlines()[0].strip()
+    ref_line = ref_line.rstrip(")")
+    return ref_line
+
+_BUYER_START = "Pembeli Barang Kena Pajak/Penerima Jasa Kena Pajak"
+_BUYER_ENDS = ("Nama Barang Kena Pajak", "Dasar Pengenaan Pajak")
+
+def _buyer_block_span(text: str) -> Optional[Tuple[int, int]]:
+    """(start, end) of the buyer block, or None. Plain substring searches: the block is delimited by fixed labels."""
+    start = text.find(_BUYER_START)
+    if start < 0:
+        return None
+    start += len(_BUYER_START)
+    ends = [i for i in (text.find(label, start) for label in _BUYER_ENDS) if i >= 0]
+    if not ends:
+        return None
+    return start, min(ends)
+
+def extract_buyer_block(text: str) -> str:
+    """Return the text block for 'Pembeli Barang Kena Pajak / Penerima Jasa Kena Pajak' section."""
+    span = _buyer_block_span(text)
+    return text[span[0]:span[1]] if span else ""
+
+def parse_buyer_fields(text: str) -> Dict[str, str]:
+    b = extract_buyer_block(text)
+    result = {"buyer_npwp": "", "buyer_name": "", "buyer_address": "", "buyer_email": "", "buyer_id_tku": ""}
+
+    m = _NPWP_RE.search(b)
+    if m:
+        result["buyer_npwp"] = m.group(1).translate(_NPWP_STRIP)
+
+    name = _labelled_line(b, "Nama")
+    if name is not None:
+        result["buyer_name"] = name.strip()
+
+    # The address runs to the first NPWP/Email label after it (on any line), else to the end
+    j = _value_start(b, "Alamat")
+    if j >= 0:
+        end = min([i for i in (b.find("NPWP", j), b.find("Email", j)) if i >= 0] + [len(b)])
+        address = " ".join(s for line in b[j:end].splitlines() if (s := line.strip()))
+        result["buyer_address"] = address.strip()
+
+    m = _EMAIL_RE.search(b)
+    if m:
+        result["buyer_email"] = m.group(1).strip()
+
+    m = _TKU_RE.search(b)
+    if m:
+        result["buyer_id_tku"] = m.group(1).strip()
+
+    return result
+
+def _date_start(text: str) -> int:
+    """
+    Where process_pdf starts looking for the invoice date: after the buyer block when there is one.
+    The date sits by the signature further down, and the seller/buyer addresses above it can hold
+    date-like street names ("Jl. 17 Agustus 1945") that would otherwise be taken for it.
+    """
+    span = _buyer_block_span(text)
+    return span[1] if span else 0
+
+# Everything process_pdf reports besides the buyer block and date: once each of these has matched on
+# some page, the first match of every parser lies in the pages read so far.
+_PAGE_MARKERS = (_KODE_RE.search, lambda t: _labelled_line(t, "Referensi"))
+
+# PDFium is not thread-safe, and in-process extraction runs on Streamlit's per-session script threads
+_PDFIUM_LOCK = threading.Lock()
+# Hold it across fork() so pool workers never start from a PDFium call caught half-way on another thread
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_PDFIUM_LOCK.acquire, after_in_parent=_PDFIUM_LOCK.release,
+                        after_in_child=_PDFIUM_LOCK.release)
+
+def extract_text_from_pdf_bytes(file_bytes: bytes, until_complete: bool = False) -> str:
+    """
+    Page texts joined by newlines. With until_complete, stop after the page on which the last
+    of the fields process_pdf needs (date, kode seri, reference, buyer block) shows up.
+    """
+    # PDFium extracts each page natively in one call; pdfplumber built a Python object per character.
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(file_bytes)
+        try:
+            parts = []
+            pending = list(_PAGE_MARKERS) if until_complete else None
+            # The date only counts once it follows a complete buyer block (see _date_start)
+            buyer_seen = date_seen = False
+            for page in pdf:
+                # Close PDFium handles as we go rather than leaving them to the garbage collector
+                textpage = page.get_textpage()
+                try:
+                    page_text = textpage.get_text_bounded()
+                finally:
+                    textpage.close()
+                    page.close()
+                parts.append(page_text)
+                if pending is not None:
+                    pending = [found for found in pending if not found(page_text)]
+                    if not buyer_seen:
+                        span = _buyer_block_span(page_text)
+                        buyer_seen = span is not None
+                        date_seen = buyer_seen and _DATE_RE.search(page_text, span[1]) is not None
+                    elif not date_seen:
+                        date_seen = _DATE_RE.search(page_text) is not None
+                    if not pending and date_seen:
+                        break
+            return "\n".join(parts)
+        finally:
+            pdf.close()
+
+def extract_text_with_pdfplumber(file_bytes: bytes) -> str:
+    """Layout-ordered page texts joined by newlines. Much slower; only a fallback for PDFium."""
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        return "\n".join(page.extract_text() or "" for page in pdf.pages)
+
+def _has_coretax_anchors(text: str) -> bool:
+    return _KODE_RE.search(text) is not None and _buyer_block_span(text) is not None
+
+# Keys of process_pdf's result, in results-table column order.
+RESULT_FIELDS = ("date", "facture_type", "kode_seri_raw", "reference", "buyer_npwp",
+                 "buyer_name", "buyer_address", "buyer_email", "buyer_id_tku")
+
+def process_pdf(file_bytes: bytes) -> Dict[str, str]:
+    """Extract and parse one Coretax PDF into the result columns (without the filename)."""
+    text = extract_text_from_pdf_bytes(file_bytes, until_complete=True)
+    if not _has_coretax_anchors(text):
+        # PDFium returns content-stream order; on layouts where that splits the labels from their
+        # values, pdfplumber's reading-order text can still parse
+        fallback = extract_text_with_pdfplumber(file_bytes)
+        if _has_coretax_anchors(fallback):
+            text = fallback
+    kode_info = parse_kode_seri_type(text)
+    buyer = parse_buyer_fields(text)
+    return {
+        "date": parse_date_from_text(text, _date_start(text)),
+        "facture_type": kode_info.get("type"),
+        "kode_seri_raw": kode_info.get("raw_code"),
+        "reference": parse_reference(text),
+        "buyer_npwp": buyer.get("buyer_npwp"),
+        "buyer_name": buyer.get("buyer_name"),
+        "buyer_address": buyer.get("buyer_address"),
+        "buyer_email": buyer.get("buyer_email"),
+        "buyer_id_tku": buyer.get("buyer_id_tku")
+    }
+
+def pdf_worker_count() -> int:
+    """How many worker processes pdf_pool starts: up to min(8, cores)."""
+    return min(8, os.cpu_count() or 1)
+
+def pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Worker processes for running process_pdf, or None to stay in-process.
+    Files are independent, so they spread over pdf_worker_count() workers (PDFium is not
+    thread-safe and the regex parsing holds the GIL, so threads would not overlap any work).
+    Workers are forked: Streamlit installs app.py as __main__, and spawn/forkserver workers
+    would re-run the whole app on start-up. Forking from the threaded server is best done once,
+    so create one pool and keep it; all its workers are forked by the first submit.
+    """
+    workers = pdf_worker_count()
+    if workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))